@@ -1,97 +1,69 @@
 from __future__ import annotations
 
-import base64
-import random
 import time
-import ggwave
+from typing import Callable
 
-from scripts.baseline_ggwave_file import init_rx, decode_two_ways, SR, PROTOCOL_ID
-from scripts.ggwave_codec import encoded_bytes_to_f32
+import numpy as np
+
+from scripts.arq_core import (
+    UnreliableChannel, get_rx, put_rx, phy_encode_frame, phy_encode_ack, phy_decode_frame
+)
+from scripts.config import BENCH_PAYLOAD
 from scripts.packet import (
-    fragment_message, unpack_frame, reassemble_frames,
-    pack_ack, TYPE_DATA, TYPE_ACK
+    Reassembler, fragment_message, try_unpack_frame, peek_frame_type,
+    TYPE_DATA, TYPE_ACK
 )
 
-# --- PHY helpers (строка через ggwave) ---
-
-def phy_encode_text(text: str) -> bytes:
-    return ggwave.encode(text, protocolId=PROTOCOL_ID, volume=10)
-
-def phy_decode_text(inst_rx, samples_bytes: bytes) -> str | None:
-    samples_f32 = encoded_bytes_to_f32(samples_bytes)
-    decoded = decode_two_ways(inst_rx, samples_f32)
-    if decoded is None:
-        return None
-    return decoded.decode("ascii", errors="strict")
-
-
-def bytes_frame_to_text(frame: bytes) -> str:
-    return base64.b64encode(frame).decode("ascii")
-
-def text_to_bytes_frame(text: str) -> bytes:
-    return base64.b64decode(text.encode("ascii"))
-
-
-# --- Simulated unreliable channel ---
-
-class UnreliableChannel:
-    def __init__(self, drop_prob: float = 0.2, delay_ms: int = 0):
-        self.drop_prob = drop_prob
-        self.delay_ms = delay_ms
-        self.queue: list[bytes] = []
-
-    def send(self, phy_samples: bytes):
-        # drop
-        if random.random() < self.drop_prob:
-            return
-        # delay (optional)
-        if self.delay_ms > 0:
-            time.sleep(self.delay_ms / 1000.0)
-        self.queue.append(phy_samples)
-
-    def recv(self) -> bytes | None:
-        if not self.queue:
-            return None
-        return self.queue.pop(0)
-
 
 # --- Stop-and-Wait ARQ over frames ---
 
 def sender_send_message(channel_data: UnreliableChannel, channel_ack: UnreliableChannel, payload: bytes,
-                        *, msg_id: int = 1, max_payload: int = 16, timeout_s: float = 1.0, max_retries: int = 10):
+                        *, msg_id: int = 1, max_payload: int = 16, timeout_s: float = 1.0, max_retries: int = 10,
+                        pump: Callable[[], bool] | None = None):
+    # pump: шаг приёмника в этом же потоке (Receiver.step), вызывается после
+    # отправки и пока ждём ACK; True — если он что-то обработал
     frames = fragment_message(payload, msg_id=msg_id, max_payload=max_payload)
 
-    inst_rx_ack = init_rx()
+    inst_rx_ack = get_rx()
     try:
-        for raw_frame in frames:
-            # узнаем seq/total (чтобы ждать правильный ack)
-            ft, mid, seq, total, _ = unpack_frame(raw_frame)
-
-            if ft != TYPE_DATA:
-                raise RuntimeError("expected DATA frame")
-
-            text = bytes_frame_to_text(raw_frame)
+        # seq/total (чтобы ждать правильный ack) известны без разбора кадра:
+        # fragment_message нумерует кадры 0..total-1 по порядку
+        total = len(frames)
+        for seq, raw_frame in enumerate(frames):
+            # кодируем кадр один раз, повторы шлют те же сэмплы
+            data_samples = phy_encode_frame(raw_frame)
 
             retries = 0
             while True:
                 # отправляем DATA
-                channel_data.send(phy_encode_text(text))
+                channel_data.send(data_samples)
+                if pump is not None:
+                    pump()
 
                 # ждём ACK
-                deadline = time.time() + timeout_s
+                # монотонные часы в целых наносекундах: без float и скачков системного времени
+                deadline_ns = time.monotonic_ns() + int(timeout_s * 1e9)
                 got_ack = False
-                while time.time() < deadline:
+                while time.monotonic_ns() < deadline_ns:
                     ack_samples = channel_ack.recv()
                     if ack_samples is None:
-                        time.sleep(0.01)
+                        if pump is None:
+                            time.sleep(0.01)
+                            continue
+                        if not pump():
+                            # приёмник в этом же потоке простаивает, канал ACK пуст:
+                            # ACK уже не придёт — сразу таймаут, без сна до deadline
+                            break
                         continue
 
-                    ack_text = phy_decode_text(inst_rx_ack, ack_samples)
-                    if ack_text is None:
+                    ack_frame = phy_decode_frame(inst_rx_ack, ack_samples)
+                    if ack_frame is None or peek_frame_type(ack_frame) != TYPE_ACK:
                         continue
 
-                    ack_frame = text_to_bytes_frame(ack_text)
-                    aft, amid, aseq, atotal, _apayload = unpack_frame(ack_frame)
+                    fields = try_unpack_frame(ack_frame)
+                    if fields is None:
+                        continue  # битый кадр (CRC)
+                    aft, amid, aseq, atotal, _apayload = fields
                     if aft == TYPE_ACK and amid == msg_id and aseq == seq and atotal == total:
                         got_ack = True
                         break
@@ -106,109 +78,80 @@ def sender_send_message(channel_data: UnreliableChannel, channel_ack: Unreliable
                     raise RuntimeError(f"SENDER failed: too many retries on seq={seq}")
 
     finally:
-        if hasattr(ggwave, "free"):
-            try:
-                ggwave.free(inst_rx_ack)
-            except Exception:
-                pass
+        put_rx(inst_rx_ack)
 
 
-def receiver_run(channel_data: UnreliableChannel, channel_ack: UnreliableChannel,
-                 *, msg_id: int = 1, grace_after_assembled_s: float = 2.0):
-    inst_rx_data = init_rx()
-    try:
-        got_parts: dict[int, bytes] = {}
-        expected_total: int | None = None
-
-        assembled_data: bytes | None = None
-        assembled_at: float | None = None
-
-        while True:
-            # Если уже собрали — работаем ещё чуть-чуть как "ACK-сервис", потом выходим
-            if assembled_data is not None and assembled_at is not None:
-                if time.time() - assembled_at >= grace_after_assembled_s:
-                    return assembled_data
-
-            samples = channel_data.recv()
-            if samples is None:
-                time.sleep(0.01)
-                continue
-
-            text = phy_decode_text(inst_rx_data, samples)
-            if text is None:
-                continue
-
-            raw_frame = text_to_bytes_frame(text)
-            ft, mid, seq, total, payload = unpack_frame(raw_frame)
-
-            if ft != TYPE_DATA or mid != msg_id:
-                continue
-
-            # сохраняем часть (повторы допускаем)
-            if expected_total is None:
-                expected_total = total
-            got_parts[seq] = payload
-
-            # шлём ACK всегда (и на повторы тоже)
-            ack = pack_ack(msg_id=mid, seq=seq, total=total)
-            channel_ack.send(phy_encode_text(bytes_frame_to_text(ack)))
-            print(f"RECV: got seq={seq}/{total-1}, sent ACK")
-
-            # проверяем сборку
-            assembled = reassemble_frames(got_parts, expected_total)
-            if assembled is not None and assembled_data is None:
-                assembled_data = assembled
-                assembled_at = time.time()
-                print(f"RECV: assembled len={len(assembled_data)}")
+class Receiver:
+    """
+    Приёмник без своего потока: sender «прокачивает» его через step().
+    """
+    def __init__(self, channel_data: UnreliableChannel, channel_ack: UnreliableChannel, *, msg_id: int = 1):
+        self.channel_data = channel_data
+        self.channel_ack = channel_ack
+        self.msg_id = msg_id
+        self.inst_rx = get_rx()
 
-    finally:
-        if hasattr(ggwave, "free"):
-            try:
-                ggwave.free(inst_rx_data)
-            except Exception:
-                pass
+        self.parts: Reassembler | None = None  # создаётся по первому кадру (нужен total)
+        self.assembled: bytes | None = None
 
+    def step(self) -> bool:
+        # берём из канала не больше одного кадра; False — канал пуст
+        samples = self.channel_data.recv()
+        if samples is None:
+            return False
 
-def main():
-    random.seed(1)
+        raw_frame = phy_decode_frame(self.inst_rx, samples)
+        if raw_frame is None or peek_frame_type(raw_frame) != TYPE_DATA:
+            return True
 
-    # Два канала: данные и ACK (оба ненадёжные)
-    data_ch = UnreliableChannel(drop_prob=0.25)
-    ack_ch = UnreliableChannel(drop_prob=0.10)
+        fields = try_unpack_frame(raw_frame)
+        if fields is None:
+            return True  # битый кадр (CRC): ACK не шлём, sender повторит
+        ft, mid, seq, total, payload = fields
 
-    payload = b"hello world! " * 10
+        if ft != TYPE_DATA or mid != self.msg_id:
+            return True
 
-    # Запускаем receiver в "ручном" режиме: в одном потоке будем шагать
-    # (без threading, чтобы проще отлаживать)
-    # Хитрость: сначала посылаем sender, а receiver будет забирать из очереди в процессе.
-    #
-    # Для простоты делаем так:
-    # 1) sender пытается отправить кадр
-    # 2) receiver крутится и отвечает ACK
-    #
-    # Реализуем это через interleave: sender вызывает send(), receiver тут же читаeт.
+        # сохраняем часть (повторы допускаем — Reassembler их пропустит)
+        if self.parts is None:
+            self.parts = Reassembler(total)
+        assembled = self.parts.offer(seq, payload)
 
-    # Чтобы не усложнять, делаем receiver в фоне через простую петлю,
-    # а sender будет "подливать" данные.
-    import threading
-    result_holder = {"data": None, "err": None}
+        # шлём ACK всегда (и на повторы тоже)
+        self.channel_ack.send(phy_encode_ack(mid, seq, total))
+        print(f"RECV: got seq={seq}/{total-1}, sent ACK")
 
-    def recv_thread():
-        try:
-            result_holder["data"] = receiver_run(data_ch, ack_ch, msg_id=1)
-        except Exception as e:
-            result_holder["err"] = e
+        # offer() отдаёт сообщение один раз — на последней недостающей части
+        if assembled is not None:
+            self.assembled = assembled
+            print(f"RECV: assembled len={len(self.assembled)}")
+        return True
 
-    t = threading.Thread(target=recv_thread, daemon=True)
-    t.start()
+    def close(self) -> None:
+        put_rx(self.inst_rx)
 
-    sender_send_message(data_ch, ack_ch, payload, msg_id=1, max_payload=16, timeout_s=0.8, max_retries=20)
 
-    t.join(timeout=10)
-    if result_holder["err"]:
-        raise result_holder["err"]
+def main():
+    # Два канала: данные и ACK (оба ненадёжные), у каждого свой генератор.
+    data_ch = UnreliableChannel(drop_prob=0.25, rng=np.random.default_rng(1))
+    ack_ch = UnreliableChannel(drop_prob=0.10, rng=np.random.default_rng(2))
+
+    payload = BENCH_PAYLOAD
+
+    # Всё в одном потоке: после каждой отправки DATA sender сам вызывает
+    # receiver.step(), тот сразу отвечает ACK. Без threading — нет передачи
+    # GIL между потоками, проще отлаживать, и результат воспроизводим.
+    receiver = Receiver(data_ch, ack_ch, msg_id=1)
+    try:
+        sender_send_message(data_ch, ack_ch, payload, msg_id=1, max_payload=16, timeout_s=0.8, max_retries=20,
+                            pump=receiver.step)
+        # добираем то, что осталось в канале
+        while receiver.step():
+            pass
+    finally:
+        receiver.close()
 
-    received = result_holder["data"]
+    received = receiver.assembled
     print("FINAL:", "OK" if received == payload else "FAIL")
 
 
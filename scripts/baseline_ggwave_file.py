@@ -2,42 +2,39 @@ from __future__ import annotations
 
 import numpy as np
 import ggwave
-from scripts.ggwave_codec import encoded_bytes_to_f32
+from scripts.ggwave_codec import decode_pcm, encoded_bytes_to_f32
 
 SR = 48000
 PROTOCOL_ID = 0
 
+# Нарезка по 20 мс в decode_two_ways. Текущие сборки декодируют целый буфер
+# одним вызовом, а на пустом результате цикл лишь копировал срезы впустую.
+_STREAMING_REQUIRED = False
+
 
 def decode_two_ways(inst_rx, samples_f32: np.ndarray) -> bytes | None:
     if samples_f32.dtype != np.float32:
         samples_f32 = samples_f32.astype(np.float32, copy=False)
 
-    # 1) ndarray
-    try:
-        d = ggwave.decode(inst_rx, samples_f32)
-        if d:
-            return d
-    except Exception:
-        pass
-
-    # 2) bytes (one-shot)
+    # 1) один вызов: ndarray или bytes, смотря что принимает сборка
     try:
-        d = ggwave.decode(inst_rx, samples_f32.tobytes())
+        d = decode_pcm(inst_rx, samples_f32)
         if d:
             return d
     except Exception:
         pass
 
-    # 3) bytes streaming
-    chunk = int(SR * 0.02)  # 20ms
-    for i in range(0, len(samples_f32), chunk):
-        part = samples_f32[i:i + chunk]
-        try:
-            d = ggwave.decode(inst_rx, part.tobytes())
-            if d:
-                return d
-        except Exception:
-            pass
+    # 2) bytes streaming — только для сборок, которым нужен потоковый приём
+    if _STREAMING_REQUIRED:
+        chunk = int(SR * 0.02)  # 20ms
+        for i in range(0, len(samples_f32), chunk):
+            part = samples_f32[i:i + chunk]
+            try:
+                d = ggwave.decode(inst_rx, part.tobytes())
+                if d:
+                    return d
+            except Exception:
+                pass
 
     return None
 
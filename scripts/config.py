@@ -0,0 +1,18 @@
+from __future__ import annotations
+
+import numpy as np
+
+# Общие параметры и хелперы экспериментов: одна и та же полезная нагрузка
+# во всех measure-скриптах и демо, создаётся один раз при импорте.
+
+BENCH_PAYLOAD = b"hello world! " * 10  # 130 байт, длиннее одного кадра
+
+
+def pctls(vals, qs) -> np.ndarray:
+    """
+    Перцентили nearest-rank (qs в долях 0..1) одним O(N) np.partition
+    вместо полной сортировки на каждый перцентиль.
+    """
+    a = np.asarray(vals)
+    idxs = np.rint(np.asarray(qs) * (len(a) - 1)).astype(np.intp)
+    return np.partition(a, idxs)[idxs]
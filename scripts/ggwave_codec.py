@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import threading
+
 import numpy as np
 import ggwave
 
@@ -8,23 +10,97 @@ def bytes_to_float32_pcm(pcm_bytes: bytes) -> np.ndarray:
     a = np.frombuffer(pcm_bytes, dtype=np.float32)
     if a.size == 0:
         return np.array([], dtype=np.float32)
-    if not np.isfinite(a).all():
-        return np.array([], dtype=np.float32)
-    if float(np.max(np.abs(a))) > 10.0:
+    # NaN/Inf проходят через max, поэтому одной проверки максимума достаточно
+    m = float(np.max(np.abs(a)))
+    if not np.isfinite(m) or m > 10.0:
         return np.array([], dtype=np.float32)
     return a
 
 
-def i16_to_f32_pcm(samples_i16: np.ndarray) -> np.ndarray:
-    return (samples_i16.astype(np.float32) / 32768.0)
+_SCRATCH = threading.local()
+
+
+def get_scratch(n: int) -> np.ndarray:
+    # thread-local float32 буфер, растёт степенями двойки
+    buf = getattr(_SCRATCH, "f32", None)
+    if buf is None or buf.size < n:
+        buf = np.empty(1 << max(0, (n - 1).bit_length()), dtype=np.float32)
+        _SCRATCH.f32 = buf
+    return buf[:n]
 
 
-def encoded_bytes_to_f32(encoded: bytes) -> np.ndarray:
-    f32 = bytes_to_float32_pcm(encoded)
-    if f32.size != 0:
-        return f32
+def i16_to_f32_pcm(samples_i16: np.ndarray, *, out: np.ndarray | None = None) -> np.ndarray:
+    # cast + scale за один проход, без промежуточного float32-массива
+    if out is None:
+        out = np.empty(samples_i16.shape, dtype=np.float32)
+    np.multiply(samples_i16, np.float32(1.0 / 32768.0), out=out, casting="unsafe")
+    return out
+
+
+def encoded_bytes_to_f32(
+    encoded: bytes,
+    *,
+    trusted_int16: bool = False,
+    reuse_buffer: bool = False,
+) -> np.ndarray:
+    # trusted_int16: источник заведомо отдаёт int16 (например, запись с микрофона),
+    # проход-проверка float32-интерпретации не нужен.
+    # Длина не кратна 4 — это точно не float32, проверку тоже пропускаем.
+    if not trusted_int16 and len(encoded) % 4 == 0:
+        f32 = bytes_to_float32_pcm(encoded)
+        if f32.size != 0:
+            return f32
     i16 = np.frombuffer(encoded, dtype=np.int16)
-    return i16_to_f32_pcm(i16)
+    # reuse_buffer: int16 -> float32 пишется в thread-local буфер без аллокации.
+    # Результат валиден до следующего вызова в этом потоке — только для
+    # декодирования «сразу на месте».
+    out = get_scratch(i16.size) if reuse_buffer else None
+    return i16_to_f32_pcm(i16, out=out)
+
+
+def pcm_f32_bytes(samples_f32: np.ndarray) -> bytes:
+    # ggwave.decode принимает только bytes. Если массив — view поверх bytes
+    # (np.frombuffer в encoded_bytes_to_f32), отдаём исходный буфер без копии.
+    base = samples_f32.base
+    if (
+        isinstance(base, bytes)
+        and samples_f32.dtype == np.float32
+        and samples_f32.flags.c_contiguous
+        and len(base) == samples_f32.nbytes
+    ):
+        return base
+    return np.ascontiguousarray(samples_f32, dtype=np.float32).tobytes()
+
+
+def pcm_f32_buffer(samples_f32: np.ndarray) -> memoryview:
+    # байтовый memoryview поверх float32-данных, без копии для contiguous-массивов
+    return memoryview(np.ascontiguousarray(samples_f32, dtype=np.float32)).cast("B")
+
+
+# Какой вход принимает ggwave.decode: ndarray, buffer (memoryview) или bytes.
+# Определяется на первом вызове decode_pcm (сборки 0.4.x берут только bytes),
+# дальше каждый кадр — один вызов без заведомо неудачных попыток и исключений.
+_DECODE_INPUTS = {
+    "ndarray": lambda a: a,
+    "buffer": pcm_f32_buffer,
+    "bytes": pcm_f32_bytes,
+}
+_DECODE_INPUT: str | None = None
+
+
+def decode_pcm(inst_rx, samples_f32: np.ndarray) -> bytes | None:
+    # один вызов ggwave.decode по выбранному пути
+    global _DECODE_INPUT
+    if _DECODE_INPUT is None:
+        for kind in ("ndarray", "buffer"):
+            try:
+                d = ggwave.decode(inst_rx, _DECODE_INPUTS[kind](samples_f32))
+            except TypeError:
+                continue
+            _DECODE_INPUT = kind
+            return d or None
+        _DECODE_INPUT = "bytes"
+    return ggwave.decode(inst_rx, _DECODE_INPUTS[_DECODE_INPUT](samples_f32)) or None
 
 
 def decode_stream(
@@ -32,16 +108,20 @@ def decode_stream(
     samples_f32: np.ndarray,
     *,
     sample_rate: int = 48000,
-    chunk_ms: int = 20,
+    chunk_ms: int | None = None,
 ) -> bytes | None:
-    if samples_f32.dtype != np.float32:
-        samples_f32 = samples_f32.astype(np.float32, copy=False)
+    pcm = pcm_f32_bytes(samples_f32)
+
+    # по умолчанию — один вызов на весь буфер (один переход Python -> C);
+    # нарезка нужна только для потокового приёма
+    if chunk_ms is None:
+        return ggwave.decode(inst_rx, pcm) or None
 
     chunk = max(1, int(sample_rate * (chunk_ms / 1000.0)))
+    step = chunk * 4  # float32
 
-    for i in range(0, len(samples_f32), chunk):
-        part = samples_f32[i:i + chunk]
-        decoded = ggwave.decode(inst_rx, part.tobytes())
+    for off in range(0, len(pcm), step):
+        decoded = ggwave.decode(inst_rx, pcm[off:off + step])
         if decoded:
             return decoded
 
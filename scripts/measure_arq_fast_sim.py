@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import heapq
+import math
+import multiprocessing
+from dataclasses import dataclass
+from typing import Callable, ClassVar, Iterator, final
+
+import numpy as np
+
+from scripts.config import BENCH_PAYLOAD, pctls
+from scripts.packet import (
+    Reassembler,
+    TYPE_ACK,
+    TYPE_DATA,
+    fragment_message,
+    pack_ack,
+    try_unpack_frame,
+)
+
+# Fast simulation of the same Stop-and-Wait ARQ as measure_arq.py, without the
+# ggwave PHY: frames travel as raw bytes through a virtual channel with drop,
+# corruption and delay, and time is virtual (milliseconds), so a full grid with
+# hundreds of runs per point finishes in seconds. Framing/CRC/ARQ logic is the
+# real one from scripts.packet.
+
+
+# ----------------- Virtual channel -----------------
+
+@dataclass
+class ChannelParams:
+    drop_prob: float = 0.0
+    corrupt_prob: float = 0.0
+    delay_ms: float = 0.0
+
+
+def _no_corrupt(data: bytes) -> bytes:
+    return data
+
+
+@final
+class VirtualChannel:
+    """
+    Frames are delivered delay_ms after send (virtual time), may be dropped,
+    or arrive with one byte flipped (CRC fail on the receiver).
+    """
+    # drop/corrupt uniforms come from numpy in batches, not one Python-level
+    # random() call per decision; a run needs from tens to thousands of draws,
+    # so the batch starts small and doubles on every refill
+    DRAW_BATCH_MIN: ClassVar[int] = 1 << 6
+    DRAW_BATCH_MAX: ClassVar[int] = 1 << 14
+
+    def __init__(self, params: ChannelParams, rng: np.random.Generator | None = None) -> None:
+        self.p: ChannelParams = params
+        self.rng: np.random.Generator = rng if rng is not None else np.random.default_rng()
+        # min-heap of (deliver_at_ms, send seq, data): plain tuples, no per-packet
+        # object; the send seq keeps ties FIFO and never lets data be compared
+        self._q: list[tuple[float, int, bytes]] = []
+        self._sent: int = 0
+        self._draws: Iterator[float] = iter(())
+        self._batch: int = self.DRAW_BATCH_MIN
+        # specialized once per channel: with corrupt_prob <= 0 send() calls a
+        # no-op instead of re-checking the probability on every frame
+        self._maybe_corrupt: Callable[[bytes], bytes] = (
+            self._corrupt if params.corrupt_prob > 0 else _no_corrupt
+        )
+
+    def reset(self, rng: np.random.Generator | None = None) -> None:
+        """
+        Back to the just-constructed state (optionally with a new generator),
+        so one channel object serves a whole series of runs.
+        """
+        if rng is not None:
+            self.rng = rng
+        self._q.clear()
+        self._sent = 0
+        self._draws = iter(())
+        self._batch = self.DRAW_BATCH_MIN
+
+    def _uniform(self) -> float:
+        u = next(self._draws, None)
+        if u is None:
+            self._draws = iter(self.rng.random(self._batch).tolist())
+            self._batch = min(self._batch * 2, self.DRAW_BATCH_MAX)
+            u = next(self._draws)
+        return u
+
+    def _corrupt(self, data: bytes) -> bytes:
+        if self._uniform() >= self.p.corrupt_prob:
+            return data
+        b = bytearray(data)
+        i = int(self._uniform() * len(b))
+        b[i] ^= 1 << int(self._uniform() * 8)
+        return bytes(b)
+
+    def send(self, data: bytes, now_ms: float) -> bool:
+        if self._uniform() < self.p.drop_prob:
+            return False
+        self._sent += 1
+        heapq.heappush(self._q, (now_ms + self.p.delay_ms, self._sent, self._maybe_corrupt(data)))
+        return True
+
+    def next_deliver_at(self) -> float:
+        # virtual time of the earliest in-flight frame, inf if the channel is idle
+        return self._q[0][0] if self._q else math.inf
+
+    def recv_ready(self, now_ms: float) -> list[bytes]:
+        # pop only what is due: O(k log n) per tick instead of two full scans
+        q = self._q
+        ready: list[bytes] = []
+        while q and q[0][0] <= now_ms:
+            ready.append(heapq.heappop(q)[2])
+        return ready
+
+
+# ----------------- Metrics -----------------
+
+@dataclass
+class RunResult:
+    ok: bool
+    seconds: float  # virtual time
+    goodput_Bps: float
+    frames_total: int
+    retries_total: int
+    data_sent: int
+    data_dropped: int
+    ack_sent: int
+    ack_dropped: int
+    crc_fail: int
+
+
+# ----------------- ARQ over the virtual channel -----------------
+
+# indices into run_once_sim's counters list (same layout idea as measure_arq, plus crc_fail)
+_DATA_SENT, _DATA_DROPPED, _ACK_SENT, _ACK_DROPPED, _RETRIES, _CRC_FAIL = range(6)
+_N_COUNTERS = 6
+
+def run_once_sim(
+    *,
+    payload: bytes,
+    data_ch: VirtualChannel,
+    ack_ch: VirtualChannel,
+    max_payload: int,
+    timeout_ms: float,
+    max_retries: int,
+    step_ms: float = 1.0,
+) -> RunResult:
+    counters = [0] * _N_COUNTERS
+
+    msg_id = 1
+    # created when the first DATA frame gives total
+    parts: Reassembler | None = None
+    assembled: bytes | None = None
+
+    now_ms: float = 0.0
+    # ACK frames already validated by try_unpack_frame. ACK bytes are a pure
+    # function of (msg_id, seq, total), so a bit-exact duplicate (the receiver
+    # ACKs every retransmit) is skipped without re-parsing or re-CRCing; a
+    # corrupted copy differs and still goes through try_unpack_frame (crc_fail).
+    acked: set[bytes] = set()
+
+    def receiver_pump() -> None:
+        """
+        Deliver all DATA frames due by now_ms and answer each with an ACK.
+        """
+        nonlocal parts, assembled
+        for raw_frame in data_ch.recv_ready(now_ms):
+            fields = try_unpack_frame(raw_frame)
+            if fields is None:
+                counters[_CRC_FAIL] += 1
+                continue
+            ft, mid, seq, total, part = fields
+            if ft != TYPE_DATA or mid != msg_id:
+                continue
+
+            if parts is None:
+                parts = Reassembler(total)
+            if seq >= parts.total:
+                continue  # inconsistent total
+
+            if total == frames_total:
+                ack_frame = ack_table[seq]
+            else:
+                ack_frame = pack_ack(msg_id=mid, seq=seq, total=total)
+
+            counters[_ACK_SENT] += 1
+            if not ack_ch.send(ack_frame, now_ms):
+                counters[_ACK_DROPPED] += 1
+
+            res = parts.offer(seq, part)
+            if res is not None:
+                assembled = res
+
+    def sender_wait_ack(seq: int, total: int) -> bool:
+        """
+        Advance virtual time in step_ms ticks until the matching ACK or the timeout.
+        Ticks with nothing to deliver are skipped: time jumps straight to the
+        tick of the next delivery (or the deadline), same timestamps as stepping.
+        """
+        nonlocal now_ms
+        deadline_ms = now_ms + timeout_ms
+        while now_ms < deadline_ms:
+            next_ms = min(data_ch.next_deliver_at(), ack_ch.next_deliver_at(), deadline_ms)
+            now_ms += max(1, math.ceil((next_ms - now_ms) / step_ms)) * step_ms
+            receiver_pump()
+            for ack_frame in ack_ch.recv_ready(now_ms):
+                if ack_frame in acked:
+                    continue  # duplicate of an ACK the sender already consumed
+                fields = try_unpack_frame(ack_frame)
+                if fields is None:
+                    counters[_CRC_FAIL] += 1
+                    continue
+                aft, amid, aseq, atotal, _ = fields
+                if aft == TYPE_ACK and amid == msg_id:
+                    acked.add(ack_frame)
+                    if aseq == seq and atotal == total:
+                        return True
+        return False
+
+    frames = fragment_message(payload, msg_id=msg_id, max_payload=max_payload)
+    frames_total = len(frames)
+    # every ACK this run can produce, built (and CRC'd) once up front
+    ack_table = [pack_ack(msg_id=msg_id, seq=seq, total=frames_total) for seq in range(frames_total)]
+    ok = True
+
+    # fragment_message numbers frames 0..total-1 in order
+    total = frames_total
+    for seq, raw_frame in enumerate(frames):
+
+        retries = 0
+        while True:
+            counters[_DATA_SENT] += 1
+            if not data_ch.send(raw_frame, now_ms):
+                counters[_DATA_DROPPED] += 1
+
+            if sender_wait_ack(seq, total):
+                break
+
+            retries += 1
+            counters[_RETRIES] += 1
+            if retries >= max_retries:
+                ok = False
+                break
+
+        if not ok:
+            break
+
+    # no final pump: the receiver ACKs a part only after taking it, so by the
+    # last ACK it already holds every part and now_ms is the true finish time
+
+    ok = ok and assembled == payload
+    seconds = max(1e-9, now_ms / 1000.0)
+    return RunResult(
+        ok=ok,
+        seconds=seconds,
+        goodput_Bps=(len(payload) / seconds) if ok else 0.0,
+        frames_total=frames_total,
+        retries_total=counters[_RETRIES],
+        data_sent=counters[_DATA_SENT],
+        data_dropped=counters[_DATA_DROPPED],
+        ack_sent=counters[_ACK_SENT],
+        ack_dropped=counters[_ACK_DROPPED],
+        crc_fail=counters[_CRC_FAIL],
+    )
+
+
+# ----------------- Grid experiment -----------------
+
+
+def _run_config(job: dict) -> list[RunResult]:
+    # one pool job = every seed of one grid point, so the two channels are
+    # built once per job and reset between seeds
+    job = dict(job)
+    seeds = job.pop("seeds")
+    data_ch = VirtualChannel(job.pop("data_params"))
+    ack_ch = VirtualChannel(job.pop("ack_params"))
+
+    results: list[RunResult] = []
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        data_ch.reset(rng)
+        ack_ch.reset(rng)
+        results.append(run_once_sim(data_ch=data_ch, ack_ch=ack_ch, **job))
+    return results
+
+
+def main(processes: int | None = None) -> None:
+    max_payload_grid = [8, 16, 24, 32]
+    timeout_grid_ms = [100, 200, 300, 500, 800]
+
+    runs_per_config = 200
+    data_params = ChannelParams(drop_prob=0.25, corrupt_prob=0.02, delay_ms=20)
+    ack_params = ChannelParams(drop_prob=0.10, corrupt_prob=0.01, delay_ms=20)
+    max_retries = 30
+
+    payload = BENCH_PAYLOAD
+
+    configs = [(mp, t) for mp in max_payload_grid for t in timeout_grid_ms]
+    jobs = [
+        dict(
+            payload=payload,
+            data_params=data_params,
+            ack_params=ack_params,
+            max_payload=max_payload,
+            timeout_ms=timeout_ms,
+            max_retries=max_retries,
+            seeds=range(1000, 1000 + runs_per_config),
+        )
+        for max_payload, timeout_ms in configs
+    ]
+
+    # one job per grid point (see _run_config); results come back in config order
+    with multiprocessing.Pool(processes) as pool:
+        per_config: list[list[RunResult]] = pool.map(_run_config, jobs)
+
+    print("max_pl  timeout_ms  success  goodput_avg  time_p50  time_p90  retries_avg  crc_fail_avg")
+    print("------  ----------  -------  -----------  --------  --------  -----------  ------------")
+
+    for (max_payload, timeout_ms), results in zip(configs, per_config):
+
+        ok_results = [r for r in results if r.ok]
+        success_rate = len(ok_results) / len(results)
+
+        if not ok_results:
+            print(f"{max_payload:6d}  {timeout_ms:10d}  {success_rate:7.0%}      ---        ---       ---        ---          ---")
+            continue
+
+        n = len(ok_results)
+        times = np.fromiter((r.seconds for r in ok_results), dtype=np.float64, count=n)
+        gps = np.fromiter((r.goodput_Bps for r in ok_results), dtype=np.float64, count=n)
+        retries = np.fromiter((r.retries_total for r in ok_results), dtype=np.float64, count=n)
+        crc_fail = np.fromiter((r.crc_fail for r in ok_results), dtype=np.float64, count=n)
+        p50, p90 = pctls(times, (0.5, 0.9))
+
+        print(
+            f"{max_payload:6d}  "
+            f"{timeout_ms:10d}  "
+            f"{success_rate:7.0%}  "
+            f"{gps.mean():11.1f}  "
+            f"{p50:8.2f}  "
+            f"{p90:8.2f}  "
+            f"{retries.mean():11.1f}  "
+            f"{crc_fail.mean():12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,39 +11,83 @@ TYPE_ACK = 1
 _HDR_FMT = "!2sBBBBHHHH"  # magic(2), ver(1), type(1), rsv(1), rsv(1), msg_id, seq, total, length
 # проще: фиксируем 2 резервных байта под будущее (окна, флаги)
 
+# форматы разбираются один раз, а не на каждом pack/unpack/calcsize
+_HDR = struct.Struct(_HDR_FMT)
+_HDR_LEN = _HDR.size
+_CRC = struct.Struct("!I")
+
 def pack_frame(frame_type: int, msg_id: int, seq: int, total: int, payload: bytes) -> bytes:
     if not (0 <= msg_id <= 0xFFFF): raise ValueError("msg_id out of range")
     if not (0 <= seq <= 0xFFFF): raise ValueError("seq out of range")
     if not (0 <= total <= 0xFFFF): raise ValueError("total out of range")
     if len(payload) > 0xFFFF: raise ValueError("payload too large")
 
-    header = struct.pack(_HDR_FMT, MAGIC, VER, frame_type, 0, 0, msg_id, seq, total, len(payload))
-    body = header + payload
-    crc = zlib.crc32(body) & 0xFFFFFFFF
-    return body + struct.pack("!I", crc)
+    return _build_frame(frame_type, msg_id, seq, total, payload)
 
-def unpack_frame(raw: bytes):
-    if len(raw) < struct.calcsize(_HDR_FMT) + 4:
-        raise ValueError("frame too short")
+def _build_frame(frame_type: int, msg_id: int, seq: int, total: int, payload: bytes) -> bytes:
+    # без проверок диапазонов: их делает вызывающий (pack_frame — на каждый кадр,
+    # fragment_message — один раз на сообщение)
+    header = _HDR.pack(MAGIC, VER, frame_type, 0, 0, msg_id, seq, total, len(payload))
+    # CRC продолжаем с заголовка на payload — без промежуточного header + payload,
+    # кадр собирается одной аллокацией
+    crc = zlib.crc32(payload, zlib.crc32(header))
+    return b"".join((header, payload, _CRC.pack(crc)))
 
-    header = raw[:struct.calcsize(_HDR_FMT)]
-    magic, ver, frame_type, _r1, _r2, msg_id, seq, total, length = struct.unpack(_HDR_FMT, header)
+def _parse_frame(raw: bytes):
+    # (поля, None) для целого кадра или (None, причина) — без исключений
+    if len(raw) < _HDR_LEN + 4:
+        return None, "frame too short"
 
-    if magic != MAGIC: raise ValueError("bad magic")
-    if ver != VER: raise ValueError("bad version")
+    magic, ver, frame_type, _r1, _r2, msg_id, seq, total, length = _HDR.unpack_from(raw, 0)
 
-    payload_start = struct.calcsize(_HDR_FMT)
+    if magic != MAGIC: return None, "bad magic"
+    if ver != VER: return None, "bad version"
+
+    payload_start = _HDR_LEN
     payload_end = payload_start + length
     if payload_end + 4 > len(raw):
-        raise ValueError("bad length")
+        return None, "bad length"
 
-    payload = raw[payload_start:payload_end]
-    crc_expected = struct.unpack("!I", raw[payload_end:payload_end + 4])[0]
+    crc_expected = _CRC.unpack_from(raw, payload_end)[0]
     crc_actual = zlib.crc32(raw[:payload_end]) & 0xFFFFFFFF
     if crc_actual != crc_expected:
-        raise ValueError("bad crc")
+        return None, "bad crc"
 
-    return frame_type, msg_id, seq, total, payload
+    return (frame_type, msg_id, seq, total, raw[payload_start:payload_end]), None
+
+def unpack_frame(raw: bytes):
+    fields, err = _parse_frame(raw)
+    if err is not None:
+        raise ValueError(err)
+    return fields
+
+def try_unpack_frame(raw: bytes):
+    """
+    Как unpack_frame, но битый/чужой кадр даёт None, а не ValueError.
+    Для горячих циклов приёма, где CRC-fail — обычное событие:
+    исключение на каждый такой кадр заметно дороже проверки на None.
+    """
+    return _parse_frame(raw)[0]
+
+def peek_frame_type(raw: bytes) -> int | None:
+    """
+    Тип кадра без разбора заголовка и проверки CRC (байт после magic+ver).
+    None — это не наш кадр. Годится только для раннего отсева:
+    целостность по-прежнему проверяет unpack_frame.
+    """
+    if len(raw) < 4 or raw[:2] != MAGIC:
+        return None
+    return raw[3]
+
+def peek_header(raw: bytes):
+    """
+    (frame_type, msg_id, seq, total) из заголовка без проверки CRC, или None.
+    Как и peek_frame_type — только для быстрых решений, не для данных.
+    """
+    if len(raw) < _HDR_LEN or raw[:2] != MAGIC:
+        return None
+    _m, _ver, frame_type, _r1, _r2, msg_id, seq, total, _length = _HDR.unpack_from(raw, 0)
+    return frame_type, msg_id, seq, total
 
 def fragment_message(payload: bytes, *, msg_id: int, max_payload: int = 32) -> list[bytes]:
     """
@@ -58,11 +102,15 @@ def fragment_message(payload: bytes, *, msg_id: int, max_payload: int = 32) -> l
     if total == 0:
         total = 1  # пустое сообщение тоже можно передать одним кадром
 
-    frames: list[bytes] = []
-    for seq in range(total):
-        part = payload[seq * max_payload:(seq + 1) * max_payload]
-        frames.append(pack_frame(TYPE_DATA, msg_id=msg_id, seq=seq, total=total, payload=part))
-    return frames
+    # диапазоны проверяем один раз на сообщение, а не в pack_frame на каждый кадр
+    if not (0 <= msg_id <= 0xFFFF): raise ValueError("msg_id out of range")
+    if total > 0xFFFF: raise ValueError("total out of range")
+    if min(max_payload, len(payload)) > 0xFFFF: raise ValueError("payload too large")
+
+    return [
+        _build_frame(TYPE_DATA, msg_id, seq, total, payload[seq * max_payload:(seq + 1) * max_payload])
+        for seq in range(total)
+    ]
 
 
 def reassemble_frames(frames_payloads: dict[int, bytes], total: int) -> bytes | None:
@@ -77,14 +125,51 @@ def reassemble_frames(frames_payloads: dict[int, bytes], total: int) -> bytes |
 
     if len(frames_payloads) < total:
         return None
+    if any(seq not in frames_payloads for seq in range(total)):
+        return None
 
-    parts = []
-    for seq in range(total):
-        if seq not in frames_payloads:
+    return b"".join([frames_payloads[seq] for seq in range(total)])
+
+class Reassembler:
+    """
+    Сборка сообщения по мере прихода частей (вместо reassemble_frames после каждого кадра).
+    В Stop-and-Wait части идут по порядку: такая часть сразу дописывается в буфер,
+    пришедшая вне очереди ждёт в словаре. Повторы игнорируются.
+    """
+    def __init__(self, total: int):
+        if total <= 0:
+            raise ValueError("total must be > 0")
+        self.total = total
+        self.next = 0  # первая ещё не дописанная часть
+        self.buf = bytearray()
+        self.pending: dict[int, bytes] = {}
+        self.assembled: bytes | None = None
+
+    def has(self, seq: int) -> bool:
+        return seq < self.next or seq in self.pending
+
+    def offer(self, seq: int, part: bytes) -> bytes | None:
+        """
+        Возвращает собранное сообщение ровно один раз — когда пришла последняя
+        недостающая часть; иначе None.
+        """
+        if seq >= self.total or self.has(seq):
             return None
-        parts.append(frames_payloads[seq])
+        if seq != self.next:
+            self.pending[seq] = part
+            return None
+
+        self.buf += part
+        self.next += 1
+        pending = self.pending
+        while pending and self.next in pending:
+            self.buf += pending.pop(self.next)
+            self.next += 1
 
-    return b"".join(parts)
+        if self.next == self.total:
+            self.assembled = bytes(self.buf)
+            return self.assembled
+        return None
 
 def pack_ack(msg_id: int, seq: int, total: int) -> bytes:
     # payload пустой
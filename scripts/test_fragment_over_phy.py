@@ -1,28 +1,18 @@
 from __future__ import annotations
 
-import base64
 import ggwave
 
-from scripts.baseline_ggwave_file import init_rx, decode_two_ways, SR, PROTOCOL_ID
-from scripts.ggwave_codec import encoded_bytes_to_f32
+from scripts.arq_core import phy_decode_frame, phy_encode_frame
+from scripts.baseline_ggwave_file import init_rx, SR
+from scripts.config import BENCH_PAYLOAD
 from scripts.packet import fragment_message, unpack_frame, reassemble_frames, TYPE_DATA
 
 
-def phy_send_text(frame_bytes: bytes) -> bytes:
-    """
-    bytes -> base64 str -> PHY -> decoded bytes (base64 text)
-    """
-    b64_text = base64.b64encode(frame_bytes).decode("ascii")
-    encoded = ggwave.encode(b64_text, protocolId=PROTOCOL_ID, volume=10)
-    samples = encoded_bytes_to_f32(encoded)
-    return samples
-
-
 def main():
     inst_rx = init_rx()
     try:
         msg_id = 42
-        original = b"hello world! " * 10  # специально длиннее одного кадра
+        original = BENCH_PAYLOAD  # специально длиннее одного кадра
 
         frames = fragment_message(original, msg_id=msg_id, max_payload=16)
         print(f"Original len={len(original)} bytes, frames={len(frames)}")
@@ -31,17 +21,14 @@ def main():
         expected_total = None
 
         for idx, raw_frame in enumerate(frames):
-            # передаём кадр через PHY
-            b64_text = base64.b64encode(raw_frame).decode("ascii")
-            encoded = ggwave.encode(b64_text, protocolId=PROTOCOL_ID, volume=10)
-            samples = encoded_bytes_to_f32(encoded)
+            # передаём кадр через PHY: сырыми байтами, если ggwave их принимает
+            # (на ~25% меньше символов), иначе base64 — выбирает arq_core
+            encoded = phy_encode_frame(raw_frame)
 
-            decoded = decode_two_ways(inst_rx, samples)
-            if decoded is None:
+            raw_back = phy_decode_frame(inst_rx, encoded)
+            if raw_back is None:
                 raise RuntimeError(f"decode returned None at frame {idx}")
 
-            raw_back = base64.b64decode(decoded.decode("ascii"))
-
             frame_type, mid, seq, total, payload = unpack_frame(raw_back)
 
             if frame_type != TYPE_DATA: